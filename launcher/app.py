@@ -1,6 +1,7 @@
 from flask import Flask, render_template, request, jsonify
 from flask_socketio import SocketIO, emit
 from manager import TestManager
+from catalog import ConfigError
 import os
 import threading
 import select
@@ -18,10 +19,13 @@ terminal_sessions = {}
 
 @app.route('/')
 def index():
-    # List available tests
-    testee_dir = os.path.join(BASE_DIR, 'testee')
-    tests = [d for d in os.listdir(testee_dir) if os.path.isdir(os.path.join(testee_dir, d))]
-    return render_template('index.html', tests=tests)
+    # List available tests, served from the catalog's index
+    problems = manager.catalog.describe()
+    return render_template('index.html', tests=list(problems), problems=problems)
+
+@app.route('/tests')
+def list_tests():
+    return jsonify(manager.catalog.describe())
 
 @app.route('/start', methods=['POST'])
 def start_test():
@@ -31,6 +35,8 @@ def start_test():
     try:
         result = manager.start_test(test_name)
         return jsonify({'status': 'started', 'details': result})
+    except ConfigError as e:
+        return jsonify({'error': str(e), 'problems': e.problems}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -43,6 +49,24 @@ def stop_test():
 def status():
     return jsonify(manager.get_status())
 
+@app.route('/wall_stats')
+def wall_stats():
+    return jsonify(manager.get_wall_stats())
+
+@app.route('/sweep', methods=['GET', 'POST'])
+def link_sweep():
+    if request.method == 'GET':
+        return jsonify({**manager.sweep_state, 'results': manager.sweep_results})
+    try:
+        plan = manager.start_link_sweep(request.get_json(silent=True))
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    # A sweep takes minutes, run it outside the request and let GET /sweep report progress
+    socketio.start_background_task(manager.run_link_sweep, plan)
+    return jsonify({'status': 'started', 'total': manager.sweep_state['total']})
+
 @app.route('/exec', methods=['POST'])
 def execute_cmd():
     role = request.json.get('role')
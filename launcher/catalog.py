@@ -0,0 +1,412 @@
+import copy
+import ipaddress
+import os
+import threading
+import docker
+import requests
+import yaml
+import netem
+
+ROLES = ('A', 'B', 'W')
+DEFAULT_IMAGE = 'ubuntu:latest'
+WALL_MODES = ('sniff', 'inline')
+WALL_ACTIONS = ('accept', 'drop', 'delay', 'mark')
+WALL_PROTOCOLS = ('tcp', 'udp', 'icmp')
+WALL_MATCH_KEYS = ('src', 'dst', 'proto', 'sport', 'dport', 'domain_list')
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_port(value):
+    return _is_int(value) and 0 < value < 65536
+
+
+def _mapping(value):
+    # Optional sections: missing is fine, anything but a mapping is reported by the caller
+    return value if isinstance(value, dict) else {}
+
+
+class ConfigError(Exception):
+    """A test's configs failed validation. problems lists every issue found, not just the first."""
+
+    def __init__(self, test_name, problems):
+        self.test_name = test_name
+        self.problems = problems
+        super().__init__(f"Invalid config for {test_name}: " + '; '.join(problems))
+
+
+class TestCatalog:
+    """
+    In-memory index of the tests under testee/.
+
+    Each test's config.yaml files are parsed and validated once and served from
+    memory afterwards. Entries are keyed on the (mtime, size) of every file they
+    depend on (the configs, start_script/ directories and domain list files), so
+    editing, adding or removing one invalidates just that test; adding or
+    removing a test directory re-indexes the listing.
+    """
+
+    def __init__(self, testee_dir, client=None, subnet='172.20.0.0/16', gateway='172.20.0.1'):
+        self.testee_dir = testee_dir
+        self.client = client
+        self.subnet = ipaddress.ip_network(subnet)
+        self.gateway = ipaddress.ip_address(gateway)
+        self._lock = threading.Lock()
+        self._listing = None  # (testee dir mtime, [test names])
+        self._entries = {}    # test name -> {'deps', 'signature', 'configs', 'problems'}
+        self._images = set()  # images seen locally, only trusted for listings
+
+    # --- Index ---
+
+    def list_tests(self):
+        with self._lock:
+            mtime = os.stat(self.testee_dir).st_mtime_ns
+            if self._listing is None or self._listing[0] != mtime:
+                names = sorted(d for d in os.listdir(self.testee_dir)
+                               if os.path.isdir(os.path.join(self.testee_dir, d)))
+                self._listing = (mtime, names)
+                for stale in set(self._entries) - set(names):
+                    del self._entries[stale]
+            return list(self._listing[1])
+
+    def describe(self):
+        """Every test with its validation problems (empty list when the test is runnable)."""
+        return {name: self.problems(name) for name in self.list_tests()}
+
+    def problems(self, test_name):
+        entry = self._entry(test_name)
+        return entry['problems'] + self._image_problems(entry['configs'], fresh=False)
+
+    def require(self, test_name):
+        """
+        Validated configs for test_name ({role: config}). Raises ConfigError if anything is wrong.
+        Images are always checked against the Docker daemon here, right before a start.
+        """
+        entry = self._entry(test_name)
+        problems = entry['problems'] + self._image_problems(entry['configs'], fresh=True)
+        if problems:
+            raise ConfigError(test_name, problems)
+        return copy.deepcopy(entry['configs'])
+
+    def invalidate(self, test_name=None):
+        with self._lock:
+            if test_name is None:
+                self._listing = None
+                self._entries.clear()
+                self._images.clear()
+            else:
+                self._entries.pop(test_name, None)
+
+    # --- Cache ---
+
+    def _config_path(self, test_name, role):
+        return os.path.join(self.testee_dir, test_name, role, 'config.yaml')
+
+    def _dependencies(self, test_name, configs):
+        """Every path an entry was built from, missing ones included."""
+        test_path = os.path.join(self.testee_dir, test_name)
+        deps = [self._config_path(test_name, role) for role in ROLES]
+        for role, config in configs.items():
+            if config.get('start_script') is not None:
+                deps.append(os.path.join(test_path, role, 'start_script'))
+        lists = _mapping(_mapping(configs.get('W', {}).get('wall')).get('domain_lists'))
+        for source in lists.values():
+            if isinstance(source, str):
+                deps.append(os.path.join(test_path, 'W', 'start_script', source))
+        return deps
+
+    @staticmethod
+    def _signature(paths):
+        sig = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return tuple(sig)
+
+    def _entry(self, test_name):
+        if test_name not in self.list_tests():
+            raise ConfigError(test_name, [f"Test '{test_name}' not found in {self.testee_dir}"])
+        with self._lock:
+            entry = self._entries.get(test_name)
+            if entry is None or self._signature(entry['deps']) != entry['signature']:
+                try:
+                    configs, problems = self._load(test_name)
+                    deps = self._dependencies(test_name, configs)
+                except Exception as e:
+                    # One broken test must never take the whole listing down
+                    configs, problems = {}, [f"could not validate config: {e!r}"]
+                    deps = [self._config_path(test_name, role) for role in ROLES]
+                entry = {'deps': deps, 'signature': self._signature(deps),
+                         'configs': configs, 'problems': problems}
+                self._entries[test_name] = entry
+            return entry
+
+    # --- Validation ---
+
+    def _load(self, test_name):
+        configs, problems = {}, []
+        for role in ROLES:
+            path = self._config_path(test_name, role)
+            if not os.path.exists(path):
+                problems.append(f"{role}: config not found at {path}")
+                continue
+            try:
+                with open(path, 'r') as f:
+                    config = yaml.safe_load(f) or {}
+            except yaml.YAMLError as e:
+                problems.append(f"{role}: invalid YAML: {e}")
+                continue
+            if not isinstance(config, dict):
+                problems.append(f"{role}: config must be a mapping")
+                continue
+            configs[role] = config
+            problems += [f"{role}: {p}" for p in self._validate_role(test_name, role, config)]
+
+        problems += self._validate_addresses(configs)
+        if 'W' in configs:
+            problems += [f"W: {p}" for p in self._validate_link(configs['W'].get('link'))]
+            problems += [f"W: {p}" for p in self._validate_wall(test_name, configs['W'].get('wall'))]
+        return configs, problems
+
+    def _validate_role(self, test_name, role, config):
+        problems = []
+        image = config.get('image', DEFAULT_IMAGE)
+        if not isinstance(image, str) or not image:
+            problems.append("image must be a non-empty string")
+
+        network = config.get('network')
+        if not isinstance(network, dict):
+            problems.append("network section missing")
+            network = {}
+        ip = network.get('ip')
+        if ip is None:
+            problems.append("network.ip missing")
+        else:
+            try:
+                addr = ipaddress.ip_address(str(ip))
+                if addr not in self.subnet:
+                    problems.append(f"network.ip {ip} is outside {self.subnet}")
+                elif addr in (self.subnet.network_address, self.subnet.broadcast_address, self.gateway):
+                    problems.append(f"network.ip {ip} is reserved in {self.subnet}")
+            except ValueError:
+                problems.append(f"network.ip {ip!r} is not a valid IPv4 address")
+        ports = network.get('forward_ports') or []
+        if not isinstance(ports, list) or not all(_is_port(p) for p in ports):
+            problems.append("network.forward_ports must be a list of port numbers")
+
+        commands = config.get('start_script')
+        if commands is not None:
+            if not isinstance(commands, list) or not all(isinstance(c, str) for c in commands):
+                problems.append("start_script must be a list of commands")
+            elif not os.path.isdir(os.path.join(self.testee_dir, test_name, role, 'start_script')):
+                problems.append("start_script given but start_script/ directory is missing")
+
+        wireshark = config.get('wireshark') or {}
+        if not isinstance(wireshark, dict):
+            problems.append("wireshark must be a mapping")
+        elif not _is_port(wireshark.get('port', 3000)):
+            problems.append("wireshark.port must be a port number")
+        return problems
+
+    def _validate_addresses(self, configs):
+        problems = []
+        seen_ips, seen_ports = {}, {}
+        for role, config in configs.items():
+            network = config.get('network') if isinstance(config.get('network'), dict) else {}
+            ip = network.get('ip')
+            if ip is not None:
+                if str(ip) in seen_ips:
+                    problems.append(f"{role}: network.ip {ip} already used by {seen_ips[str(ip)]}")
+                seen_ips.setdefault(str(ip), role)
+
+            # Host ports are published by create_container, two roles can't share one
+            ports = network.get('forward_ports') or []
+            ports = [p for p in ports if _is_port(p)] if isinstance(ports, list) else []
+            wireshark = config.get('wireshark')
+            if isinstance(wireshark, dict) and wireshark.get('enabled', False) and _is_port(wireshark.get('port', 3000)):
+                ports.append(wireshark.get('port', 3000))
+            for port in ports:
+                if port in seen_ports:
+                    problems.append(f"{role}: host port {port} already used by {seen_ports[port]}")
+                seen_ports.setdefault(port, role)
+        return problems
+
+    def _validate_link(self, link):
+        if link is None:
+            return []
+        if not isinstance(link, dict):
+            return ["link must be a mapping"]
+        problems = []
+        profiles = link.get('profiles') or {}
+        if not isinstance(profiles, dict):
+            problems.append("link.profiles must be a mapping")
+            profiles = {}
+
+        def check(where, profile):
+            if isinstance(profile, str):
+                if profile not in profiles:
+                    problems.append(f"{where}: unknown link profile '{profile}'")
+                return
+            if profile is not None and not isinstance(profile, dict):
+                problems.append(f"{where}: must be a profile name or a mapping")
+                return
+            try:
+                netem.netem_args(profile)
+            except ValueError as e:
+                problems.append(f"{where}: {e}")
+
+        for name, profile in profiles.items():
+            check(f"link.profiles.{name}", profile)
+        for role in netem.LINK_BANDS:
+            if link.get(role) is not None:
+                check(f"link.{role}", link[role])
+
+        sweep = link.get('sweep') or {}
+        if not isinstance(sweep, dict):
+            return problems + ["link.sweep must be a mapping"]
+        links = sweep.get('links', [])
+        if not isinstance(links, list):
+            problems.append("link.sweep.links must be a list")
+            links = []
+        for role in links:
+            if role not in netem.LINK_BANDS:
+                problems.append(f"link.sweep.links: unknown link '{role}'")
+        sweep_profiles = sweep.get('profiles', [])
+        if not isinstance(sweep_profiles, list):
+            problems.append("link.sweep.profiles must be a list")
+            sweep_profiles = []
+        for name in sweep_profiles:
+            check("link.sweep.profiles", name)
+        grid = sweep.get('grid') or {}
+        if not isinstance(grid, dict):
+            problems.append("link.sweep.grid must be a mapping")
+            grid = {}
+        check("link.sweep.grid", {k: None for k in grid})
+        for key in ('ping_count', 'transfer_bytes'):
+            if key in sweep and not (_is_int(sweep[key]) and sweep[key] > 0):
+                problems.append(f"link.sweep.{key} must be a positive integer")
+        return problems
+
+    def _validate_wall(self, test_name, wall):
+        if wall is None:
+            return []
+        if not isinstance(wall, dict):
+            return ["wall must be a mapping"]
+        problems = []
+        if wall.get('mode', 'sniff') not in WALL_MODES:
+            problems.append(f"wall.mode must be one of {', '.join(WALL_MODES)}")
+        if wall.get('default', 'accept') not in WALL_ACTIONS:
+            problems.append(f"wall.default must be one of {', '.join(WALL_ACTIONS)}")
+        for key in ('queue_num', 'max_len', 'max_pending'):
+            if key in wall and not (_is_int(wall[key]) and wall[key] >= 0):
+                problems.append(f"wall.{key} must be a non-negative integer")
+        if 'stats_interval' in wall and not (isinstance(wall['stats_interval'], (int, float))
+                                             and not isinstance(wall['stats_interval'], bool)
+                                             and wall['stats_interval'] > 0):
+            problems.append("wall.stats_interval must be a positive number")
+
+        lists = wall.get('domain_lists') or {}
+        if not isinstance(lists, dict):
+            problems.append("wall.domain_lists must be a mapping of list name to file or domains")
+            lists = {}
+        script_dir = os.path.join(self.testee_dir, test_name, 'W', 'start_script')
+        for name, source in lists.items():
+            if isinstance(source, str):
+                if not os.path.isfile(os.path.join(script_dir, source)):
+                    problems.append(f"wall.domain_lists.{name}: file {source} not found under start_script/")
+            elif source is not None and not (isinstance(source, list) and all(isinstance(d, str) for d in source)):
+                problems.append(f"wall.domain_lists.{name} must be a file path or a list of domains")
+
+        rules = wall.get('rules') or []
+        if not isinstance(rules, list):
+            problems.append("wall.rules must be a list")
+            rules = []
+        seen_names = {}
+        for i, rule in enumerate(rules):
+            where = f"wall.rules[{i}]"
+            if not isinstance(rule, dict):
+                problems.append(f"{where} must be a mapping")
+                continue
+            # Names label the per-rule hit counts in /wall_stats, keep them unambiguous
+            name = rule.get('name')
+            if name == 'default':
+                problems.append(f"{where}: name 'default' is reserved for the default action")
+            elif name is not None and name in seen_names:
+                problems.append(f"{where}: name '{name}' already used by wall.rules[{seen_names[name]}]")
+            seen_names.setdefault(name, i)
+            # Mirrors what verdict.Rule needs on W, a rule it can't compile kills the wall process
+            action = rule.get('action', 'accept')
+            if action not in WALL_ACTIONS:
+                problems.append(f"{where}: action must be one of {', '.join(WALL_ACTIONS)}")
+            if 'name' in rule and not isinstance(rule['name'], str):
+                problems.append(f"{where}: name must be a string")
+            if 'mark' in rule and not (_is_int(rule['mark']) and rule['mark'] >= 0):
+                problems.append(f"{where}: mark must be a non-negative integer")
+            delay = rule.get('delay_ms', 0)
+            if isinstance(delay, bool) or not isinstance(delay, (int, float)) or delay < 0:
+                problems.append(f"{where}: delay_ms must be a non-negative number")
+
+            match = rule.get('match') or {}
+            if not isinstance(match, dict):
+                problems.append(f"{where}: match must be a mapping")
+                continue
+            unknown = set(match) - set(WALL_MATCH_KEYS)
+            if unknown:
+                problems.append(f"{where}: unknown match keys {sorted(unknown)}")
+            proto = match.get('proto')
+            if proto is not None and proto not in WALL_PROTOCOLS and not (_is_int(proto) and 0 <= proto <= 255):
+                problems.append(f"{where}: match.proto must be one of {', '.join(WALL_PROTOCOLS)} or a protocol number")
+            for key in ('sport', 'dport'):
+                if match.get(key) is not None and not _is_port(match[key]):
+                    problems.append(f"{where}: match.{key} must be a port number")
+            for key in ('src', 'dst'):
+                if match.get(key) is not None:
+                    try:
+                        ipaddress.ip_network(str(match[key]), strict=False)
+                    except ValueError:
+                        problems.append(f"{where}: match.{key} {match[key]!r} is not an IP or CIDR")
+            domain_list = match.get('domain_list')
+            names = [domain_list] if isinstance(domain_list, str) else domain_list or []
+            if not isinstance(names, list):
+                problems.append(f"{where}: match.domain_list must be a list name or a list of names")
+                names = []
+            for name in names:
+                if name not in lists:
+                    problems.append(f"{where}: unknown domain list '{name}'")
+        return problems
+
+    def _image_problems(self, configs, fresh):
+        # Not part of the cached entry: images come and go without touching the test files.
+        # Listings trust images seen before to stay cheap, fresh (start) checks ask Docker every time.
+        if self.client is None:
+            return []
+        problems = []
+        for role, config in configs.items():
+            image = config.get('image', DEFAULT_IMAGE)
+            if not isinstance(image, str):
+                continue
+            with self._lock:
+                if not fresh and image in self._images:
+                    continue
+            # The Docker call itself runs unlocked, only the shared set is guarded
+            try:
+                self.client.images.get(image)
+                found = True
+            except docker.errors.ImageNotFound:
+                found = False
+                problems.append(f"{role}: image {image} not found locally")
+            except (docker.errors.DockerException, requests.exceptions.ConnectionError) as e:
+                # APIError included; covers a daemon that went away after start-up
+                problems.append(f"{role}: could not inspect image {image}: {e}")
+                continue
+            with self._lock:
+                if found:
+                    self._images.add(image)
+                else:
+                    self._images.discard(image)
+        return problems
@@ -1,16 +1,35 @@
 import docker
 import os
-import yaml
 import time
 import io
+import json
 import tarfile
+import netem
+from catalog import TestCatalog
 
 class TestManager:
+    NETWORK_SUBNET = '172.20.0.0/16'
+    NETWORK_GATEWAY = '172.20.0.1'
+    SWEEP_BASE_PORT = 5201
+    WALL_CONFIG_PATH = '/app/wall_config.json'
+    WALL_STATS_PATH = '/app/wall_stats.json'
+
     def __init__(self, base_dir):
         self.client = docker.from_env()
         self.base_dir = base_dir
         self.network_name = "wall_sim_net"
+        self.catalog = TestCatalog(
+            os.path.join(base_dir, 'testee'),
+            client=self.client,
+            subnet=self.NETWORK_SUBNET,
+            gateway=self.NETWORK_GATEWAY
+        )
         self.containers = {}
+        self.link_iface = None
+        self.peer_ips = {}
+        self.link_config = {}
+        self.sweep_results = []
+        self.sweep_state = {'running': False, 'done': 0, 'total': 0, 'error': None}
 
     def _make_tarfile(self, source_dir):
         stream = io.BytesIO()
@@ -19,17 +38,25 @@ class TestManager:
         stream.seek(0)
         return stream
 
-    def _run_start_script(self, test_name, role):
+    def _put_file(self, container, path, data):
+        # put_archive only takes tar streams, wrap a single in-memory file
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode='w') as tar:
+            info = tarfile.TarInfo(name=os.path.basename(path))
+            info.size = len(data)
+            info.mtime = time.time()
+            tar.addfile(info, io.BytesIO(data))
+        stream.seek(0)
+        container.put_archive(os.path.dirname(path), stream)
+
+    def _run_start_script(self, test_name, role, config):
         if role not in self.containers:
             return
             
         container = self.containers[role]
         test_path = os.path.join(self.base_dir, 'testee', test_name)
-        config_path = os.path.join(test_path, role, 'config.yaml')
         script_dir = os.path.join(test_path, role, 'start_script')
         
-        # Load config to check for start_script
-        config = self.load_config(test_name).get(role, {})
         commands = config.get('start_script')
         
         if commands and os.path.isdir(script_dir):
@@ -60,16 +87,8 @@ class TestManager:
 
 
     def load_config(self, test_name):
-        test_path = os.path.join(self.base_dir, 'testee', test_name)
-        configs = {}
-        for role in ['A', 'B', 'W']:
-            config_path = os.path.join(test_path, role, 'config.yaml')
-            if os.path.exists(config_path):
-                with open(config_path, 'r') as f:
-                    configs[role] = yaml.safe_load(f)
-            else:
-                raise FileNotFoundError(f"Config for {role} not found at {config_path}")
-        return configs
+        # Parsed and validated once by the catalog, raises ConfigError listing every problem
+        return self.catalog.require(test_name)
 
     def setup_network(self):
         try:
@@ -80,8 +99,8 @@ class TestManager:
         
         # Create a subnet where we can control IPs
         ipam_pool = docker.types.IPAMPool(
-            subnet='172.20.0.0/16',
-            gateway='172.20.0.1'
+            subnet=self.NETWORK_SUBNET,
+            gateway=self.NETWORK_GATEWAY
         )
         ipam_config = docker.types.IPAMConfig(pool_configs=[ipam_pool])
         return self.client.networks.create(
@@ -141,6 +160,7 @@ class TestManager:
             print(f"[{role}] Failed to start Wireshark sidecar: {e}")
 
     def start_test(self, test_name):
+        # Fails here, before any container exists, if the test's configs are invalid
         configs = self.load_config(test_name)
         network = self.setup_network()
         
@@ -161,8 +181,16 @@ class TestManager:
         # Start Wireshark Sidecar for W if configured
         self._start_wireshark_sidecar('W', self.containers['W'], w_config)
         
+        # Hand the wall section to W's wall process before it starts
+        wall_config = w_config.get('wall', {}) or {}
+        if wall_config:
+            try:
+                self._put_file(self.containers['W'], self.WALL_CONFIG_PATH, json.dumps(wall_config).encode())
+            except Exception as e:
+                print(f"[W] Failed to copy wall config: {e}")
+
         # Run start script for W
-        self._run_start_script(test_name, 'W')
+        self._run_start_script(test_name, 'W', w_config)
 
         # Enable forwarding on W and disable ICMP redirects
         # Disabling redirects is CRITICAL: 
@@ -182,7 +210,7 @@ class TestManager:
             network.connect(self.containers[role], ipv4_address=ip)
             self.containers[role].start()
             
-            self._run_start_script(test_name, role)
+            self._run_start_script(test_name, role, cfg)
 
         # Configure Routes
         # A -> B via W
@@ -195,6 +223,7 @@ class TestManager:
         
         print("Configuring static routes and suppressing ARP...")
         
+        w_iface = "eth0"
         try:
             # Helper to rename interface and update internal state
             def configure_interface(role, ip_addr):
@@ -261,8 +290,140 @@ class TestManager:
         except Exception as e:
             print(f"Error configuring static ARP: {e}")
 
+        # Link emulation has to come after the rename, the qdisc tree is bound to the interface name
+        self.setup_link_emulation(w_iface, {'A': a_ip, 'B': b_ip}, w_config.get('link', {}))
+
+        if wall_config.get('mode') == 'inline':
+            self.setup_inline_wall(w_iface, wall_config)
+
         return str({k: v.status for k,v in self.containers.items()})
 
+    def _resolve_link_profile(self, profile):
+        # A link entry is either an inline profile dict or the name of one under link.profiles
+        if isinstance(profile, str):
+            profiles = self.link_config.get('profiles', {}) or {}
+            if profile not in profiles:
+                raise ValueError(f"Unknown link profile '{profile}'")
+            return profiles[profile] or {}
+        return profile or {}
+
+    def _exec_on_w(self, cmds):
+        for cmd in cmds:
+            exit_code, output = self.containers['W'].exec_run(cmd)
+            if exit_code != 0:
+                print(f"[W] tc failed ({exit_code}): {cmd}: {output.decode().strip()}")
+
+    def setup_link_emulation(self, iface, peer_ips, link_config):
+        self.link_iface = iface
+        self.peer_ips = peer_ips
+        self.link_config = link_config or {}
+
+        print(f"[W] Installing netem qdiscs on {iface}...")
+        self._exec_on_w(netem.setup_commands(iface, peer_ips))
+        self.apply_link_profiles({role: self.link_config.get(role) for role in netem.LINK_BANDS})
+
+    def apply_link_profiles(self, links):
+        """Swap the netem parameters of the W -> A / W -> B links in place (no container restart)."""
+        if 'W' not in self.containers or not self.link_iface:
+            raise RuntimeError("Test not running")
+        resolved = {role: self._resolve_link_profile(links.get(role)) for role in netem.LINK_BANDS}
+        for role, profile in resolved.items():
+            print(f"[W] Link W->{role}: {' '.join(netem.netem_args(profile)) or 'ideal'}")
+        self._exec_on_w(netem.apply_commands(self.link_iface, resolved))
+        return resolved
+
+    def measure_link(self, ping_count=10, transfer_bytes=4 * 1024 * 1024, port=5201, timeout=60):
+        """Measure A <-> B latency (ping) and A -> B throughput (TCP bulk transfer) through W."""
+        b_ip = self.peer_ips['B']
+        result = {}
+
+        exit_code, output = self.containers['A'].exec_run(f"ping -q -c {ping_count} -i 0.2 {b_ip}")
+        result.update(netem.parse_ping(output.decode(errors='replace')))
+
+        sink = netem.SINK_SCRIPT.format(port=port, timeout=timeout)
+        source = netem.SOURCE_SCRIPT.format(host=b_ip, port=port, size=transfer_bytes, timeout=timeout)
+        self.containers['B'].exec_run(["python3", "-c", sink], detach=True)
+        exit_code, output = self.containers['A'].exec_run(["python3", "-c", source])
+        output = output.decode(errors='replace').strip()
+        try:
+            elapsed = float(output.splitlines()[-1]) if exit_code == 0 else None
+        except (IndexError, ValueError):
+            elapsed = None
+        if elapsed is not None:
+            result['transfer_bytes'] = transfer_bytes
+            result['transfer_seconds'] = elapsed
+            result['throughput_mbps'] = transfer_bytes * 8 / elapsed / 1e6 if elapsed > 0 else None
+        else:
+            result['transfer_error'] = output
+        return result
+
+    def start_link_sweep(self, sweep=None):
+        """
+        Resolve a sweep into its points and mark it running. The caller runs
+        run_link_sweep(plan) in the background; progress shows in sweep_state.
+        Uses link.sweep from W's config unless an explicit sweep dict is given.
+        """
+        if self.sweep_state['running']:
+            raise RuntimeError("A sweep is already running")
+        if 'W' not in self.containers or not self.link_iface:
+            raise RuntimeError("Test not running")
+        sweep = sweep or self.link_config.get('sweep') or {}
+        links = sweep.get('links', list(netem.LINK_BANDS))
+        points = [self._resolve_link_profile(name) for name in sweep.get('profiles', [])]
+        if sweep.get('grid') or not points:
+            points += netem.expand_grid(sweep.get('grid'))
+        for profile in points:
+            netem.netem_args(profile)
+
+        self.sweep_results = []
+        self.sweep_state = {'running': True, 'done': 0, 'total': len(points), 'error': None}
+        return {'links': links, 'points': points, 'sweep': sweep}
+
+    def run_link_sweep(self, plan):
+        """Walk the points of a plan from start_link_sweep, measuring each one."""
+        links, points, sweep = plan['links'], plan['points'], plan['sweep']
+        try:
+            for i, profile in enumerate(points):
+                print(f"[Sweep] Point {i + 1}/{len(points)}: {profile}")
+                self.apply_link_profiles({role: profile for role in links})
+                metrics = self.measure_link(
+                    ping_count=sweep.get('ping_count', 10),
+                    transfer_bytes=sweep.get('transfer_bytes', 4 * 1024 * 1024),
+                    # A sink left behind by a failed transfer would still hold the previous port
+                    port=self.SWEEP_BASE_PORT + i % 1000,
+                )
+                self.sweep_results.append({'links': links, 'profile': profile, **metrics})
+                self.sweep_state['done'] = i + 1
+        except Exception as e:
+            print(f"[Sweep] Failed: {e}")
+            self.sweep_state['error'] = str(e)
+        finally:
+            # Leave the links as configured rather than at the last sweep point
+            try:
+                self.apply_link_profiles({role: self.link_config.get(role) for role in netem.LINK_BANDS})
+            except Exception as e:
+                print(f"[Sweep] Failed to restore link profiles: {e}")
+            self.sweep_state['running'] = False
+        return self.sweep_results
+
+    def setup_inline_wall(self, iface, wall_config):
+        # Everything W forwards goes through the queue. --queue-bypass lets packets
+        # pass (fail-open) whenever the wall process is not bound to the queue.
+        queue_num = wall_config.get('queue_num', 0)
+        cmd = f"iptables -A FORWARD -i {iface} -j NFQUEUE --queue-num {queue_num} --queue-bypass"
+        print(f"[W] Inline mode: {cmd}")
+        exit_code, output = self.containers['W'].exec_run(cmd)
+        if exit_code != 0:
+            print(f"[W] Failed to install NFQUEUE rule ({exit_code}): {output.decode().strip()}")
+
+    def get_wall_stats(self):
+        if 'W' not in self.containers:
+            return {}
+        exit_code, output = self.containers['W'].exec_run(f"cat {self.WALL_STATS_PATH}")
+        if exit_code != 0:
+            return {}
+        return json.loads(output.decode())
+
     def _get_mac_for_config(self, role, iface_name):
         cmd = f"cat /sys/class/net/{iface_name}/address"
         exit_code, output = self.containers[role].exec_run(cmd)
@@ -276,6 +437,7 @@ class TestManager:
             except:
                 pass
         self.containers = {}
+        self.link_iface = None
 
     def get_status(self):
         status = {}
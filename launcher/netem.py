@@ -0,0 +1,147 @@
+import itertools
+import re
+
+# Link condition emulation for W.
+#
+# Both A and B sit on the same bridge, so W only has one interface (eth_wallsim)
+# carrying both directions of the proxy chain. To shape the two links
+# independently we hang a prio qdisc off the root and give each peer its own
+# band with a netem child:
+#
+#   root 1: prio  (priomap sends everything to band 3 by default)
+#     1:1 -> 10: netem   traffic W -> A (matched by dst IP)
+#     1:2 -> 20: netem   traffic W -> B (matched by dst IP)
+#     1:3 -> untouched
+#
+# A profile is a plain dict as written in W's config.yaml, e.g.
+#   {rate: 10mbit, latency: 40ms, jitter: 5ms, loss: 1%, reorder: 0.5%}
+
+LINK_BANDS = {'A': 1, 'B': 2}
+
+PROFILE_KEYS = ('bandwidth', 'rate', 'latency', 'delay', 'jitter', 'loss', 'reorder')
+
+
+def _pct(value):
+    value = str(value).strip()
+    return value if value.endswith('%') else f"{value}%"
+
+
+def netem_args(profile):
+    """Translate a link profile into netem arguments (without the 'netem' keyword)."""
+    profile = profile or {}
+    unknown = set(profile) - set(PROFILE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown link profile keys: {sorted(unknown)}")
+
+    args = []
+    delay = profile.get('latency', profile.get('delay'))
+    jitter = profile.get('jitter')
+    reorder = profile.get('reorder')
+
+    # netem only reorders packets that are delayed, and jitter needs a base delay too
+    if (jitter or reorder) and not delay:
+        delay = '1ms'
+
+    if delay:
+        args += ['delay', str(delay)]
+        if jitter:
+            args += [str(jitter)]
+    loss = profile.get('loss')
+    if loss:
+        args += ['loss', _pct(loss)]
+    if reorder:
+        args += ['reorder', _pct(reorder)]
+    rate = profile.get('bandwidth', profile.get('rate'))
+    if rate:
+        args += ['rate', str(rate)]
+    return args
+
+
+def setup_commands(iface, peer_ips):
+    """Commands installing the prio/netem tree on iface. peer_ips maps role -> IP."""
+    # 'replace' also drops any tree left over from a previous run
+    cmds = [f"tc qdisc replace dev {iface} root handle 1: prio bands 3 priomap 2 2 2 2 2 2 2 2 2 2 2 2 2 2 2 2"]
+    for role, band in LINK_BANDS.items():
+        cmds.append(f"tc qdisc add dev {iface} parent 1:{band} handle {band}0: netem")
+        cmds.append(
+            f"tc filter add dev {iface} parent 1: protocol ip prio 1 "
+            f"u32 match ip dst {peer_ips[role]}/32 flowid 1:{band}"
+        )
+    return cmds
+
+
+def apply_commands(iface, links):
+    """Commands swapping the netem parameters in place. links maps role -> profile."""
+    # 'change' only touches the attributes tc sends, and tc leaves out rate/reorder when
+    # unset, so a previous profile's rate would survive. 'replace' resets the whole qdisc.
+    cmds = []
+    for role, band in LINK_BANDS.items():
+        args = ' '.join(netem_args(links.get(role)))
+        cmds.append(f"tc qdisc replace dev {iface} parent 1:{band} handle {band}0: netem {args}".rstrip())
+    return cmds
+
+
+def expand_grid(grid):
+    """Cartesian product of a {param: [values]} grid as a list of profiles."""
+    if not grid:
+        return [{}]
+    keys = list(grid)
+    values = [v if isinstance(v, list) else [v] for v in (grid[k] for k in keys)]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+# --- Measurement helpers ---
+
+# Runs on B: accept one connection, drain it, then ack so the sender can stop its clock.
+SINK_SCRIPT = """
+import socket
+s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+s.bind(('0.0.0.0', {port}))
+s.listen(1)
+s.settimeout({timeout})
+c, _ = s.accept()
+c.settimeout({timeout})
+while c.recv(65536):
+    pass
+c.sendall(b'ok')
+c.close()
+"""
+
+# Runs on A: push N bytes through W to B and print the elapsed seconds.
+SOURCE_SCRIPT = """
+import socket, time
+chunk = b'x' * 65536
+for _ in range(50):
+    try:
+        s = socket.create_connection(('{host}', {port}), timeout={timeout})
+        break
+    except OSError:
+        time.sleep(0.1)
+else:
+    raise SystemExit('sink not reachable')
+s.settimeout({timeout})
+start = time.time()
+left = {size}
+while left > 0:
+    n = s.send(chunk[:min(left, len(chunk))])
+    left -= n
+s.shutdown(socket.SHUT_WR)
+s.recv(2)
+print(time.time() - start)
+"""
+
+_RTT_RE = re.compile(r"= ([\d.]+)/([\d.]+)/([\d.]+)/([\d.]+) ms")
+_LOSS_RE = re.compile(r"([\d.]+)% packet loss")
+
+
+def parse_ping(output):
+    """Extract rtt min/avg/max/mdev (ms) and loss (%) from iputils ping output."""
+    result = {}
+    m = _RTT_RE.search(output)
+    if m:
+        result.update(zip(('rtt_min_ms', 'rtt_avg_ms', 'rtt_max_ms', 'rtt_mdev_ms'), map(float, m.groups())))
+    m = _LOSS_RE.search(output)
+    if m:
+        result['ping_loss_pct'] = float(m.group(1))
+    return result
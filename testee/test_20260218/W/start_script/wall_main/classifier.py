@@ -0,0 +1,321 @@
+import os
+import socket
+import struct
+from collections import OrderedDict, namedtuple
+
+# How much of a flow's first bytes we are willing to reassemble before giving up.
+# A ClientHello with a large key share fits comfortably in this.
+MAX_PREFIX = 8192
+MAX_SEGMENTS = 16
+MAX_FLOWS = 65536
+
+HTTP_METHODS = (b'GET ', b'POST ', b'PUT ', b'HEAD ', b'DELETE ', b'OPTIONS ', b'PATCH ', b'TRACE ', b'CONNECT ')
+
+TCP_FIN, TCP_SYN, TCP_RST, TCP_ACK = 0x01, 0x02, 0x04, 0x10
+
+# proto is 'tls', 'http', 'connect' or 'unknown'; lists are the domain lists the host matched
+Classification = namedtuple('Classification', ['proto', 'host', 'lists'])
+
+PENDING = Classification('pending', None, frozenset())
+UNKNOWN = Classification('unknown', None, frozenset())
+
+
+# --- Domain lists ---
+
+class DomainMatcher:
+    """
+    Matches a host against any number of domain lists in one pass.
+
+    Every list entry is compiled into a single suffix table (domain -> names of
+    the lists containing it), so a lookup costs one dict probe per label of the
+    host, independent of how many domains the lists hold. 'example.com' matches
+    itself and every subdomain, like the usual blocklist formats.
+    """
+
+    def __init__(self, lists):
+        table = {}
+        for name, domains in lists.items():
+            for domain in domains:
+                domain = self.normalize(domain.lstrip('*').lstrip('.'))
+                if domain:
+                    table.setdefault(domain, set()).add(name)
+        self.table = {domain: frozenset(names) for domain, names in table.items()}
+
+    @staticmethod
+    def normalize(host):
+        return host.strip().lower().rstrip('.')
+
+    def match(self, host):
+        host = self.normalize(host)
+        found = frozenset()
+        while host:
+            names = self.table.get(host)
+            if names:
+                found |= names
+            dot = host.find('.')
+            if dot < 0:
+                break
+            host = host[dot + 1:]
+        return found
+
+    def __len__(self):
+        return len(self.table)
+
+
+def load_domain_lists(spec, base_dir='.'):
+    """
+    Build {list name: [domains]} from the wall.domain_lists config section.
+    A list is either inline (a YAML list) or a path to a file with one domain per
+    line, relative to the start_script directory. '#' starts a comment.
+    """
+    lists = {}
+    for name, source in (spec or {}).items():
+        if isinstance(source, str):
+            with open(os.path.join(base_dir, source), 'r') as f:
+                lists[name] = [line.split('#', 1)[0].strip() for line in f]
+            lists[name] = [d for d in lists[name] if d]
+        else:
+            lists[name] = list(source or [])
+    return lists
+
+
+# --- Application layer sniffing ---
+
+def _split_host_port(value):
+    if value.startswith('['):
+        return value[1:value.find(']')]
+    return value.rsplit(':', 1)[0] if value.count(':') == 1 else value
+
+
+def parse_http(buf):
+    """Host of an HTTP request (CONNECT target, absolute URI or Host header), None if incomplete."""
+    line_end = buf.find(b'\r\n')
+    if line_end < 0:
+        return None
+    try:
+        method, target, _ = bytes(buf[:line_end]).decode('latin-1').split(' ', 2)
+    except ValueError:
+        return UNKNOWN
+
+    if method == 'CONNECT':
+        return Classification('connect', _split_host_port(target), frozenset())
+    if '://' in target:
+        host_port = target.split('://', 1)[1].split('/', 1)[0]
+        return Classification('http', _split_host_port(host_port), frozenset())
+
+    head_end = buf.find(b'\r\n\r\n')
+    headers = bytes(buf[line_end + 2:head_end if head_end >= 0 else len(buf)])
+    for line in headers.split(b'\r\n'):
+        if line[:5].lower() == b'host:':
+            return Classification('http', _split_host_port(line[5:].decode('latin-1').strip()), frozenset())
+    if head_end < 0:
+        return None
+    return Classification('http', None, frozenset())
+
+
+def parse_tls(buf):
+    """SNI of a TLS ClientHello, None if more bytes are needed."""
+    # Collect the handshake message, which may be split over several records
+    handshake = bytearray()
+    pos = 0
+    while True:
+        if len(buf) < pos + 5:
+            return None
+        if buf[pos] != 0x16:
+            return UNKNOWN
+        rec_len = struct.unpack_from('!H', buf, pos + 3)[0]
+        if len(buf) < pos + 5 + rec_len:
+            return None
+        handshake += buf[pos + 5:pos + 5 + rec_len]
+        pos += 5 + rec_len
+        if len(handshake) >= 4:
+            if handshake[0] != 0x01:
+                return UNKNOWN
+            if len(handshake) >= 4 + int.from_bytes(handshake[1:4], 'big'):
+                break
+
+    try:
+        p = 4 + 2 + 32
+        p += 1 + handshake[p]                                   # session id
+        p += 2 + struct.unpack_from('!H', handshake, p)[0]      # cipher suites
+        p += 1 + handshake[p]                                   # compression methods
+        ext_end = p + 2 + struct.unpack_from('!H', handshake, p)[0]
+        p += 2
+        while p + 4 <= ext_end:
+            ext_type, ext_len = struct.unpack_from('!HH', handshake, p)
+            p += 4
+            if ext_type == 0:
+                # server_name_list: list length, then (type, length, name) entries
+                q = p + 2
+                while q + 3 <= p + ext_len:
+                    name_type, name_len = handshake[q], struct.unpack_from('!H', handshake, q + 1)[0]
+                    if name_type == 0:
+                        host = bytes(handshake[q + 3:q + 3 + name_len]).decode('ascii', 'replace')
+                        return Classification('tls', host, frozenset())
+                    q += 3 + name_len
+            p += ext_len
+    except (IndexError, struct.error):
+        return UNKNOWN
+    return Classification('tls', None, frozenset())
+
+
+def sniff_host(buf):
+    """Classification for a flow prefix, None while it could still go either way."""
+    if buf[:1] == b'\x16':
+        return parse_tls(buf)
+    head = bytes(buf[:8])
+    maybe_http = False
+    for method in HTTP_METHODS:
+        if head.startswith(method):
+            return parse_http(buf)
+        maybe_http = maybe_http or method.startswith(head)
+    return None if maybe_http else UNKNOWN
+
+
+# --- Flow tracking ---
+
+class _FlowState:
+    __slots__ = ('client', 'next_seq', 'buf', 'out_of_order', 'segments')
+
+    def __init__(self):
+        self.client = None
+        self.next_seq = None
+        self.buf = bytearray()
+        self.out_of_order = {}
+        self.segments = 0
+
+
+class FlowClassifier:
+    """
+    Classifies each TCP flow once from the first bytes its client sends.
+
+    Only the client -> server prefix is reassembled (in sequence order, up to
+    MAX_PREFIX bytes); as soon as a TLS SNI, HTTP Host or CONNECT target is
+    found the flow's result is cached and every later packet of the flow, in
+    either direction, costs a single dict lookup.
+    """
+
+    def __init__(self, matcher=None, max_flows=MAX_FLOWS):
+        self.matcher = matcher
+        self.max_flows = max_flows
+        self.results = OrderedDict()
+        self.pending = OrderedDict()
+        self.classified = 0
+
+    @staticmethod
+    def flow_key(headers):
+        src, dst, _, sport, dport = headers
+        a, b = (src, sport), (dst, dport)
+        return (a, b) if a <= b else (b, a)
+
+    def _finish(self, key, result):
+        self.pending.pop(key, None)
+        if result.host and self.matcher:
+            result = result._replace(lists=self.matcher.match(result.host))
+        self.results[key] = result
+        if len(self.results) > self.max_flows:
+            self.results.popitem(last=False)
+        self.classified += 1
+        return result
+
+    def feed(self, headers, payload):
+        """
+        Account one raw IPv4 packet (headers as returned by verdict.parse_headers).
+        Returns the flow's Classification, PENDING until enough bytes were seen,
+        or None for non TCP packets.
+        """
+        if headers[2] != socket.IPPROTO_TCP:
+            return None
+        key = self.flow_key(headers)
+        ihl = (payload[0] & 0x0F) * 4
+        if len(payload) < ihl + 20:
+            return self.results.get(key, PENDING)
+        flags = payload[ihl + 13]
+        syn = flags & TCP_SYN and not flags & TCP_ACK
+
+        result = self.results.get(key)
+        if result is not None:
+            if not syn:
+                # LRU, not FIFO: an evicted long-lived flow would be re-classified mid-stream as unknown
+                self.results.move_to_end(key)
+                return result
+            # A new connection reusing the 4-tuple must not inherit the old flow's host
+            del self.results[key]
+
+        seq = struct.unpack_from('!I', payload, ihl + 4)[0]
+        data_off = (payload[ihl + 12] >> 4) * 4
+        total_len = struct.unpack_from('!H', payload, 2)[0]
+        data = payload[ihl + data_off:total_len]
+        closing = flags & (TCP_FIN | TCP_RST)
+
+        state = self.pending.get(key)
+        if state is None or syn:
+            if closing and not data:
+                return PENDING
+            state = self.pending[key] = _FlowState()
+            self.pending.move_to_end(key)
+            if len(self.pending) > self.max_flows:
+                self.pending.popitem(last=False)
+
+        endpoint = (headers[0], headers[3])
+        if syn:
+            state.client = endpoint
+            state.next_seq = (seq + 1) & 0xFFFFFFFF
+            return PENDING
+        if data and not self._add_data(state, endpoint, seq, data):
+            return self._finish(key, UNKNOWN)
+        if not closing and (not data or endpoint != state.client):
+            return PENDING
+
+        # A FIN (or RST) may carry the last bytes, they were added above
+        final = closing or len(state.buf) >= MAX_PREFIX or state.segments >= MAX_SEGMENTS
+        result = self._sniff(state, final)
+        if result is None:
+            return PENDING
+        return self._finish(key, result)
+
+    @staticmethod
+    def _add_data(state, endpoint, seq, data):
+        """
+        Reassemble one client segment into state.buf. Server data is ignored.
+        Returns False once too many out-of-order segments are waiting.
+        """
+        if state.client is None:
+            state.client = endpoint
+        if endpoint != state.client:
+            return True
+        if state.next_seq is None:
+            state.next_seq = seq
+
+        offset = (seq - state.next_seq) & 0xFFFFFFFF
+        if offset >= 0x80000000:
+            # Retransmission, keep only what is new
+            overlap = (state.next_seq - seq) & 0xFFFFFFFF
+            if overlap >= len(data):
+                return True
+            data, offset = data[overlap:], 0
+        if offset:
+            if seq in state.out_of_order:
+                return True
+            # Only new data counts, a sniffer sees every forwarded segment twice (in and out)
+            state.segments += 1
+            if state.segments >= MAX_SEGMENTS:
+                return False
+            state.out_of_order[seq] = data
+            return True
+
+        state.segments += 1
+        state.buf += data
+        state.next_seq = (state.next_seq + len(data)) & 0xFFFFFFFF
+        while state.next_seq in state.out_of_order:
+            data = state.out_of_order.pop(state.next_seq)
+            state.buf += data
+            state.next_seq = (state.next_seq + len(data)) & 0xFFFFFFFF
+        return True
+
+    @staticmethod
+    def _sniff(state, final):
+        result = sniff_host(state.buf) if state.buf else None
+        if result is None and final:
+            return UNKNOWN
+        return result
@@ -1,17 +1,39 @@
 import threading
 from scapy.all import sniff, IP
+import json
 import logging
+import os
 import netifaces
+from verdict import InlineWall, parse_headers
+from classifier import DomainMatcher, FlowClassifier, load_domain_lists
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Wall_Main")
 
+# Written by the launcher from the 'wall' section of W's config.yaml
+WALL_CONFIG_PATH = '/app/wall_config.json'
+
+def load_wall_config():
+    if not os.path.exists(WALL_CONFIG_PATH):
+        return {}
+    with open(WALL_CONFIG_PATH, 'r') as f:
+        return json.load(f)
+
+# Set up in __main__ when wall.domain_lists is configured
+classifier = None
+
 def process_packet(packet):
     # For sniff(), 'packet' is already a Scapy packet.
     if IP in packet:
         ip_layer = packet[IP]
         print(f"Intercepted: {ip_layer.src} -> {ip_layer.dst}")
+        if classifier is not None:
+            raw = bytes(ip_layer)
+            classified = classifier.classified
+            result = classifier.feed(parse_headers(raw), raw)
+            if classifier.classified != classified:
+                print(f"Classified: {ip_layer.src} -> {ip_layer.dst} {result.proto} {result.host} {sorted(result.lists)}")
 
 def start_sniffing():
     logger.info("Starting sniffer...")
@@ -25,5 +47,14 @@ def start_sniffing():
 
 
 if __name__ == '__main__':
-    sniffer_thread = threading.Thread(target=start_sniffing, daemon=True)
-    sniffer_thread.start()
+    wall_config = load_wall_config()
+    if wall_config.get('mode') == 'inline':
+        # The launcher has queued W's forwarded traffic to NFQUEUE, we decide every packet
+        InlineWall(wall_config).run()
+    else:
+        if wall_config.get('domain_lists'):
+            classifier = FlowClassifier(DomainMatcher(load_domain_lists(wall_config['domain_lists'])))
+        sniffer_thread = threading.Thread(target=start_sniffing, daemon=True)
+        sniffer_thread.start()
+        # Keep the process alive, the sniffer is a daemon thread
+        sniffer_thread.join()
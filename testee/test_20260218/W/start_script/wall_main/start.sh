@@ -3,8 +3,8 @@
 # use venv
 source /app/venv/bin/activate
 
-# Install Python dependencies (flask, scapy, verify netifaces) inside venv
-/app/venv/bin/pip3 install scapy netifaces
+# Install Python dependencies (flask, scapy, verify netifaces, NetfilterQueue) inside venv
+/app/venv/bin/pip3 install scapy netifaces NetfilterQueue
 
 # Run main script using venv python
 nohup /app/venv/bin/python3 wall_main/main.py > wall_main/wall_main.log 2>&1 &
@@ -0,0 +1,165 @@
+import socket
+import ssl
+import struct
+
+from classifier import (
+    MAX_SEGMENTS, PENDING, TCP_ACK, TCP_FIN, TCP_SYN, UNKNOWN,
+    DomainMatcher, FlowClassifier, parse_http, parse_tls,
+)
+from verdict import parse_headers
+
+CLIENT, SERVER = '172.20.0.10', '172.20.0.11'
+
+
+def tcp_packet(src, dst, sport, dport, seq, flags=TCP_ACK, data=b''):
+    tcp = struct.pack('!HHIIBBHHH', sport, dport, seq & 0xFFFFFFFF, 0, 5 << 4, flags, 65535, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + len(data), 0, 0, 64, socket.IPPROTO_TCP, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return ip + tcp + data
+
+
+def client_hello_bytes(server_name):
+    ctx = ssl.create_default_context()
+    outgoing = ssl.MemoryBIO()
+    tls = ctx.wrap_bio(ssl.MemoryBIO(), outgoing, server_hostname=server_name)
+    try:
+        tls.do_handshake()
+    except ssl.SSLWantReadError:
+        pass
+    return outgoing.read()
+
+
+class Flow:
+    """Client side of one TCP connection, feeding its packets to a classifier."""
+
+    def __init__(self, classifier, isn=1000, sport=40000, dport=443):
+        self.classifier = classifier
+        self.isn = isn
+        self.sport = sport
+        self.dport = dport
+
+    def feed(self, packet):
+        return self.classifier.feed(parse_headers(packet), packet)
+
+    def syn(self):
+        return self.feed(tcp_packet(CLIENT, SERVER, self.sport, self.dport, self.isn, TCP_SYN))
+
+    def data(self, offset, data, flags=TCP_ACK):
+        return self.feed(tcp_packet(CLIENT, SERVER, self.sport, self.dport, self.isn + 1 + offset, flags, data))
+
+    def reply(self, data=b'x'):
+        return self.feed(tcp_packet(SERVER, CLIENT, self.dport, self.sport, 5000, data=data))
+
+
+def test_tls_client_hello_split_over_segments():
+    hello = client_hello_bytes('www.example.com')
+    flow = Flow(FlowClassifier(DomainMatcher({'blocked': ['example.com']})))
+    assert flow.syn() == PENDING
+    assert flow.data(0, hello[:100]) == PENDING
+    assert flow.data(100, hello[100:300]) == PENDING
+    result = flow.data(300, hello[300:])
+    assert (result.proto, result.host, result.lists) == ('tls', 'www.example.com', frozenset({'blocked'}))
+    # Later packets in either direction reuse the cached result
+    assert flow.reply() is result
+
+
+def test_tls_client_hello_out_of_order():
+    hello = client_hello_bytes('pypi.org')
+    flow = Flow(FlowClassifier())
+    flow.syn()
+    assert flow.data(200, hello[200:]) == PENDING
+    assert flow.data(0, hello[:200]).host == 'pypi.org'
+
+
+def test_retransmission_and_sequence_wraparound():
+    hello = client_hello_bytes('github.com')
+    classifier = FlowClassifier()
+    flow = Flow(classifier, isn=0xFFFFFFFF - 50)
+    flow.syn()
+    assert flow.data(0, hello[:120]) == PENDING
+    # Full retransmission, then a partial one carrying new bytes past the wrap
+    assert flow.data(0, hello[:120]) == PENDING
+    assert flow.data(60, hello[60:250]) == PENDING
+    assert flow.data(250, hello[250:]).host == 'github.com'
+
+
+def test_duplicates_do_not_count_as_segments():
+    flow = Flow(FlowClassifier(), dport=80)
+    flow.syn()
+    request = b'GET / HTTP/1.1\r\n'
+    for _ in range(MAX_SEGMENTS):
+        assert flow.data(0, request[:1]) == PENDING
+    # Still waiting for the Host header: only two segments of new data so far
+    assert flow.data(1, request[1:]) == PENDING
+    result = flow.data(len(request), b'Host: example.com\r\n\r\n')
+    assert result.host == 'example.com'
+
+
+def test_parse_tls_rejects_other_records():
+    assert parse_tls(b'\x17\x03\x03\x00\x01x') == UNKNOWN
+    assert parse_tls(b'\x16\x03\x01') is None
+
+
+def test_parse_http_connect():
+    result = parse_http(b'CONNECT www.example.com:443 HTTP/1.1\r\nHost: www.example.com:443\r\n\r\n')
+    assert (result.proto, result.host) == ('connect', 'www.example.com')
+
+
+def test_parse_http_absolute_uri():
+    result = parse_http(b'GET http://example.org:8080/path HTTP/1.1\r\n')
+    assert (result.proto, result.host) == ('http', 'example.org')
+
+
+def test_parse_http_host_header():
+    assert parse_http(b'GET /path HTTP/1.1\r\nUser-Agent: x\r\n') is None
+    result = parse_http(b'GET /path HTTP/1.1\r\nUser-Agent: x\r\nHost: Example.com\r\n\r\n')
+    assert (result.proto, result.host) == ('http', 'Example.com')
+
+
+def test_non_http_is_unknown():
+    flow = Flow(FlowClassifier(), dport=22)
+    flow.syn()
+    assert flow.data(0, b'SSH-2.0-OpenSSH_9.6\r\n') == UNKNOWN
+
+
+def test_results_are_lru():
+    classifier = FlowClassifier(max_flows=2)
+    flows = [Flow(classifier, sport=40000 + i, dport=80) for i in range(3)]
+    for flow in flows[:2]:
+        flow.data(0, b'GET / HTTP/1.1\r\nHost: a.com\r\n\r\n')
+    flows[0].reply()
+    flows[2].data(0, b'GET / HTTP/1.1\r\nHost: b.com\r\n\r\n')
+    assert flows[0].reply().host == 'a.com'
+    # The evicted flow is seen again mid-stream and can no longer be classified
+    assert flows[1].reply() == UNKNOWN
+
+
+def test_source_port_reuse_is_a_new_flow():
+    classifier = FlowClassifier(DomainMatcher({'blocked': ['bad.com']}))
+    old = Flow(classifier, dport=80)
+    old.syn()
+    assert old.data(0, b'GET / HTTP/1.1\r\nHost: bad.com\r\n\r\n').lists == frozenset({'blocked'})
+    new = Flow(classifier, isn=90000, dport=80)
+    assert new.syn() == PENDING
+    result = new.data(0, b'GET / HTTP/1.1\r\nHost: good.com\r\n\r\n')
+    assert (result.host, result.lists) == ('good.com', frozenset())
+
+
+def test_fin_carrying_data_is_classified():
+    request = b'GET / HTTP/1.0\r\nHost: a.com'
+    # Flow already tracked: the FIN's payload completes the request
+    flow = Flow(FlowClassifier(), dport=80)
+    flow.syn()
+    assert flow.data(0, request[:6]) == PENDING
+    assert flow.data(6, request[6:], TCP_FIN | TCP_ACK).host == 'a.com'
+    # First segment seen is the FIN itself
+    flow = Flow(FlowClassifier(), sport=40001, dport=80)
+    assert flow.data(0, request, TCP_FIN | TCP_ACK).host == 'a.com'
+    assert flow.reply().host == 'a.com'
+
+
+def test_domain_matcher_suffixes():
+    matcher = DomainMatcher({'blocked': ['example.com', '*.bad.org'], 'ads': ['ads.example.com']})
+    assert matcher.match('x.ads.example.com.') == frozenset({'blocked', 'ads'})
+    assert matcher.match('bad.org') == frozenset({'blocked'})
+    assert matcher.match('notexample.com') == frozenset()
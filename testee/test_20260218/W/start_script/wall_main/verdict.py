@@ -0,0 +1,292 @@
+import heapq
+import ipaddress
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import time
+from collections import deque
+
+from classifier import DomainMatcher, FlowClassifier, load_domain_lists
+
+logger = logging.getLogger("Wall_Verdict")
+
+ACTIONS = ('accept', 'drop', 'delay', 'mark')
+PROTOCOLS = {'icmp': socket.IPPROTO_ICMP, 'tcp': socket.IPPROTO_TCP, 'udp': socket.IPPROTO_UDP}
+
+# Rule decisions only depend on the 5-tuple, so they are cached per flow.
+FLOW_CACHE_SIZE = 65536
+
+# Columns of /proc/net/netfilter/nfnetlink_queue
+NFQUEUE_PROC = '/proc/net/netfilter/nfnetlink_queue'
+NFQUEUE_COLUMNS = ('queue_num', 'peer_portid', 'queue_total', 'copy_mode', 'copy_range',
+                   'queue_dropped', 'user_dropped', 'id_sequence')
+
+
+def read_kernel_queue(queue_num, path=NFQUEUE_PROC):
+    """Kernel-side counters of one NFQUEUE, None when the queue is not bound or /proc is unreadable."""
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if fields and int(fields[0]) == queue_num:
+                    return dict(zip(NFQUEUE_COLUMNS, map(int, fields)))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def parse_headers(payload):
+    """
+    Pull (src, dst, proto, sport, dport) out of a raw IPv4 packet.
+    Addresses are returned as ints, ports are 0 for non TCP/UDP packets.
+    Done with struct instead of scapy: this runs for every queued packet.
+    """
+    if len(payload) < 20 or payload[0] >> 4 != 4:
+        return None
+    ihl = (payload[0] & 0x0F) * 4
+    proto = payload[9]
+    src, dst = struct.unpack_from('!II', payload, 12)
+    sport = dport = 0
+    if proto in (socket.IPPROTO_TCP, socket.IPPROTO_UDP) and len(payload) >= ihl + 4:
+        sport, dport = struct.unpack_from('!HH', payload, ihl)
+    return src, dst, proto, sport, dport
+
+
+class Rule:
+    """One entry of wall.rules, compiled down to integer comparisons."""
+
+    def __init__(self, index, spec):
+        self.index = index
+        self.name = spec.get('name') or f"rule_{index}"
+        self.action = spec.get('action', 'accept')
+        if self.action not in ACTIONS:
+            raise ValueError(f"{self.name}: unknown action '{self.action}'")
+        self.delay = float(spec.get('delay_ms', 0)) / 1000
+        self.mark = int(spec.get('mark', 0))
+
+        match = spec.get('match', {}) or {}
+        self.src = self._network(match.get('src'))
+        self.dst = self._network(match.get('dst'))
+        proto = match.get('proto')
+        self.proto = PROTOCOLS[proto] if isinstance(proto, str) else proto
+        self.sport = match.get('sport')
+        self.dport = match.get('dport')
+        domain_list = match.get('domain_list')
+        self.domain_lists = frozenset([domain_list] if isinstance(domain_list, str) else domain_list or ())
+
+    @staticmethod
+    def _network(value):
+        if value is None:
+            return None
+        net = ipaddress.ip_network(str(value), strict=False)
+        return int(net.network_address), int(net.netmask)
+
+    def matches(self, headers, classification=None):
+        src, dst, proto, sport, dport = headers
+        if self.src and (src & self.src[1]) != self.src[0]:
+            return False
+        if self.dst and (dst & self.dst[1]) != self.dst[0]:
+            return False
+        if self.proto is not None and proto != self.proto:
+            return False
+        if self.sport is not None and sport != self.sport:
+            return False
+        if self.dport is not None and dport != self.dport:
+            return False
+        if self.domain_lists:
+            # Not classified (yet) never matches: the SYN passes, the ClientHello decides
+            if classification is None or not self.domain_lists & classification.lists:
+                return False
+        return True
+
+
+class VerdictEngine:
+    """
+    First-match rule evaluation with per-flow caching and hit counters.
+    With wall.domain_lists configured, TCP flows are also classified by host
+    and rules can match on match.domain_list.
+    """
+
+    def __init__(self, config, base_dir='.'):
+        self.rules = [Rule(i, spec) for i, spec in enumerate(config.get('rules', []) or [])]
+        self.default = Rule(len(self.rules), {'name': 'default', 'action': config.get('default', 'accept')})
+        # Keyed by position, names are free-form and may repeat
+        self.hits = [0] * (len(self.rules) + 1)
+        self.flow_cache = {}
+        self.classifier = None
+        if config.get('domain_lists'):
+            matcher = DomainMatcher(load_domain_lists(config['domain_lists'], base_dir))
+            self.classifier = FlowClassifier(matcher)
+            logger.info(f"Loaded {len(matcher)} domains from {len(config['domain_lists'])} lists")
+
+    def decide(self, headers, payload):
+        classification = self.classifier.feed(headers, payload) if self.classifier else None
+        # (5-tuple, classification) only changes once per flow, when it leaves the pending state
+        key = (headers, classification)
+        rule = self.flow_cache.get(key)
+        if rule is None:
+            rule = next((r for r in self.rules if r.matches(headers, classification)), self.default)
+            if len(self.flow_cache) >= FLOW_CACHE_SIZE:
+                self.flow_cache.clear()
+            self.flow_cache[key] = rule
+        self.hits[rule.index] += 1
+        return rule
+
+    def rule_hits(self):
+        return [{'rule': rule.name, 'action': rule.action, 'hits': self.hits[rule.index]}
+                for rule in self.rules + [self.default]]
+
+
+class InlineWall:
+    """
+    Consumes an NFQUEUE in batches and gives each packet a verdict.
+
+    The callback handed to NetfilterQueue only stashes the packet; verdicts are
+    issued after each drain of the queue socket. NetfilterQueue has no batch
+    verdict call (NFQNL_MSG_VERDICT_BATCH), so every packet still costs one
+    callback and one accept/drop: the throughput gain comes from the per-flow
+    rule cache in VerdictEngine, not from batched verdicts. Pending and delayed packets both hold kernel queue
+    slots; if more than max_pending of them are held, the batch and every
+    delayed packet are accepted unseen (fail-open) rather than letting the
+    kernel queue fill up. The iptables rule uses --queue-bypass so packets
+    also pass while no wall process is bound. Once the kernel queue (max_len)
+    is full anyway, the kernel drops packets: NetfilterQueue does not expose
+    the kernel's fail-open flag, so keep max_pending well below max_len.
+    """
+
+    def __init__(self, config, stats_path='/app/wall_stats.json'):
+        self.queue_num = int(config.get('queue_num', 0))
+        self.max_len = int(config.get('max_len', 4096))
+        self.max_pending = int(config.get('max_pending', 1024))
+        self.stats_interval = float(config.get('stats_interval', 1.0))
+        self.stats_path = stats_path
+        self.engine = VerdictEngine(config)
+
+        self.pending = []
+        self.delayed = []  # heap of (release_time, seq, packet)
+        self._seq = 0
+
+        self.verdicts = 0
+        self.fail_open = 0
+        self.batches = 0
+        self.max_held = 0
+        self.latencies = deque(maxlen=4096)  # per batch: drain start -> last decision
+
+    def _enqueue(self, pkt):
+        # The payload is only readable while the callback runs, copy it out now
+        self.pending.append((pkt, pkt.get_payload()))
+
+    def _verdict(self, pkt, rule=None):
+        if rule is not None and rule.action == 'drop':
+            pkt.drop()
+        else:
+            if rule is not None and rule.action == 'mark':
+                pkt.set_mark(rule.mark)
+            pkt.accept()
+        self.verdicts += 1
+
+    def process_batch(self, drained_at):
+        """Decide every packet collected by the last drain, which started at drained_at."""
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        self.batches += 1
+        held = len(batch) + len(self.delayed)
+        self.max_held = max(self.max_held, held)
+
+        if held > self.max_pending:
+            # Overloaded: let everything through instead of queueing further behind
+            self.fail_open += held
+            for pkt, _ in batch:
+                self._verdict(pkt)
+            for _, _, pkt in self.delayed:
+                self._verdict(pkt)
+            self.delayed = []
+        else:
+            delayed = []
+            for pkt, payload in batch:
+                headers = parse_headers(payload)
+                rule = self.engine.decide(headers, payload) if headers is not None else None
+                if rule is not None and rule.action == 'delay' and rule.delay > 0:
+                    delayed.append((rule.delay, pkt))
+                else:
+                    self._verdict(pkt, rule)
+            now = time.monotonic()
+            for delay, pkt in delayed:
+                self._seq += 1
+                heapq.heappush(self.delayed, (now + delay, self._seq, pkt))
+        # One sample per batch, the worst case for its packets; delay rules' hold time is not included
+        self.latencies.append(time.monotonic() - drained_at)
+
+    def release_delayed(self):
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, pkt = heapq.heappop(self.delayed)
+            self._verdict(pkt)
+
+    def stats(self):
+        lat = sorted(self.latencies)
+        kernel = read_kernel_queue(self.queue_num)
+
+        def pct(p):
+            return lat[min(len(lat) - 1, int(len(lat) * p))] * 1000 if lat else None
+
+        return {
+            'rule_hits': self.engine.rule_hits(),
+            'verdicts': self.verdicts,
+            'batches': self.batches,
+            'fail_open': self.fail_open,
+            # Packets the kernel holds for us (queue_total), including ones we have not decided yet
+            'queue_depth': kernel['queue_total'] if kernel else None,
+            'kernel_dropped': kernel['queue_dropped'] if kernel else None,
+            'user_dropped': kernel['user_dropped'] if kernel else None,
+            'delayed': len(self.delayed),
+            'max_held': self.max_held,
+            'verdict_latency_ms': {'p50': pct(0.5), 'p99': pct(0.99), 'max': lat[-1] * 1000 if lat else None},
+            'cached_flows': len(self.engine.flow_cache),
+            'classified_flows': self.engine.classifier.classified if self.engine.classifier else None,
+        }
+
+    def write_stats(self):
+        tmp = self.stats_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.stats(), f)
+        os.replace(tmp, self.stats_path)
+
+    def run(self):
+        # Imported here so sniff mode works without the NetfilterQueue extension
+        from netfilterqueue import NetfilterQueue
+
+        nfqueue = NetfilterQueue()
+        nfqueue.bind(self.queue_num, self._enqueue, max_len=self.max_len)
+        fd = nfqueue.get_fd()
+        logger.info(f"Inline mode: consuming NFQUEUE {self.queue_num} with {len(self.engine.rules)} rules")
+
+        next_stats = time.monotonic()
+        try:
+            while True:
+                # Wake up for new packets or for the next delayed release, whichever comes first
+                timeout = self.stats_interval
+                if self.delayed:
+                    timeout = max(0.0, min(timeout, self.delayed[0][0] - time.monotonic()))
+                ready, _, _ = select.select([fd], [], [], timeout)
+                if ready:
+                    drained_at = time.monotonic()
+                    nfqueue.run(block=False)
+                    self.process_batch(drained_at)
+                self.release_delayed()
+
+                if time.monotonic() >= next_stats:
+                    self.write_stats()
+                    next_stats = time.monotonic() + self.stats_interval
+        finally:
+            # Don't leave packets hanging in the kernel queue
+            for pkt, _ in self.pending:
+                self._verdict(pkt)
+            for _, _, pkt in self.delayed:
+                self._verdict(pkt)
+            self.write_stats()
+            nfqueue.unbind()